@@ -0,0 +1,82 @@
+import sqlite3
+
+from config import DEFAULT_DB
+
+column_names = ['balance', 'coin_object_id', 'version', 'digest', 'previous_transaction', 'coin_type']
+
+
+def connect(db_path=DEFAULT_DB):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def setup_db(purge, filename, db_path=DEFAULT_DB):
+    conn = connect(db_path)
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='coins'")
+
+    if cursor.fetchone():
+        if purge:
+            conn.execute("DROP TABLE coins")
+        else:
+            return conn
+
+    # Only needed to load the csv, a run against an existing db never imports pandas.
+    import pandas as pd
+
+    df = pd.read_csv(filename, chunksize=50000, names=column_names)
+    for chunk in df:
+        chunk.to_sql('coins', conn, if_exists='append', index_label='idx')
+
+    conn.execute("ALTER TABLE coins ADD COLUMN status TEXT")
+    conn.execute("ALTER TABLE coins ADD COLUMN error TEXT")
+    create_balance_index(conn)
+    conn.commit()
+    return conn
+
+
+def create_balance_index(conn, schema="main"):
+    """Index for walking the table cheapest coin first, see `--order balance`."""
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.ix_coins_balance_idx ON coins (CAST(balance AS INTEGER), idx)")
+
+
+def mark_deleted(conn, object_ids, batch_size=500):
+    object_ids = list(object_ids)
+    updated = 0
+    for i in range(0, len(object_ids), batch_size):
+        batch = object_ids[i:i+batch_size]
+        placeholders = ', '.join('?' * len(batch))
+        cursor = conn.execute(f"UPDATE coins SET status = 'deleted' WHERE coin_object_id IN ({placeholders})", batch)
+        updated += cursor.rowcount
+    conn.commit()
+    return updated
+
+
+def refresh_failed(conn, client):
+    """Re-read every coin that is not `deleted` but has a status, e.g. after ObjectVersionNotAvailableForConsumption.
+
+    Coins that still exist get their current version and digest and are reset to be merged again,
+    coins that no longer exist are marked `deleted`.
+    """
+    from pysui.sui.sui_txresults.single_tx import ObjectRead
+
+    rows = conn.execute("SELECT coin_object_id FROM coins WHERE status IS NOT NULL AND status != 'deleted'").fetchall()
+    object_ids = [row['coin_object_id'] for row in rows]
+    if not object_ids:
+        return 0, 0
+    result = client.get_objects_for(object_ids)
+    if not result.is_ok():
+        raise Exception(f"Failed to fetch objects, error: {result.result_string}")
+    refreshed, deleted = [], []
+    for object_read in result.result_data:
+        if isinstance(object_read, ObjectRead):
+            refreshed.append((str(object_read.version), object_read.digest, object_read.object_id))
+        else:
+            deleted.append(object_read.object_id)
+    conn.executemany("UPDATE coins SET version = ?, digest = ?, status = NULL, error = NULL WHERE coin_object_id = ?", refreshed)
+    conn.commit()
+    if deleted:
+        mark_deleted(conn, deleted)
+    return len(refreshed), len(deleted)
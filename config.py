@@ -0,0 +1,59 @@
+"""Arguments and client setup shared by the scripts and `merge_coins_cli.py`.
+
+Nothing heavy is imported at module level, pysui is only loaded by `make_client`.
+"""
+import gas_budget
+import planner
+import profiling
+from metrics import add_arguments as add_metrics_arguments
+
+DEFAULT_RPC_URL = "https://fullnode.testnet.sui.io:443"
+DEFAULT_DB = "coins_data.db"
+
+
+def add_rpc_arguments(parser):
+    parser.add_argument("--rpc-url", type=str, help="RPC URL to use", default=DEFAULT_RPC_URL)
+
+
+def add_signer_arguments(parser):
+    parser.add_argument("--prv-key", type=str, help="Private key to use. This should be the Keystore formatted private key. You can convert private key from wallet with `sui keytool convert <VALUE>`")
+    parser.add_argument("--signer", type=str, help="Signer address to use. str repr of SuiAddress.")
+
+
+def add_db_arguments(parser):
+    parser.add_argument("--db", type=str, help="SQLite database holding coin state.", default=DEFAULT_DB)
+
+
+def add_ingest_arguments(parser):
+    add_db_arguments(parser)
+    parser.add_argument("--filename", type=str, help="Filename to use.", default="output.csv")
+    parser.add_argument("--purge", help="Whether to purge the table if it exists.", action='store_true')
+
+
+def add_merge_arguments(parser):
+    parser.add_argument("--gas-objects", nargs='+', type=str, help="Gas objects to use. str repr of ObjectIDs.")
+    parser.add_argument("--exclude-objects", nargs='+', type=str, help="Coins never merged, e.g. gas objects used by other processes or hosts.", default=[])
+    add_ingest_arguments(parser)
+    parser.add_argument("--retry-failed", help="Whether to retry failed coins.", action='store_true')
+    parser.add_argument("--fast-path", help="Submit with WaitForEffectsCert and confirm finality in the background.", action='store_true')
+    parser.add_argument("--finality-timeout", type=float, help="Seconds to wait for a fast path transaction to be checkpointed before marking it unconfirmed.", default=120.0)
+    add_metrics_arguments(parser)
+    profiling.add_arguments(parser)
+    gas_budget.add_arguments(parser)
+    planner.add_arguments(parser)
+
+
+def add_shard_arguments(parser):
+    parser.add_argument("--shards", type=int, help="Number of shards the coin state is split into by object id prefix.", default=4)
+    parser.add_argument("--only-shards", nargs='+', type=int, help="Only run these shards on this machine.", default=None)
+    parser.add_argument("--max-restarts", type=int, help="Times a failed shard is restarted with --retry-failed.", default=3)
+
+
+def make_client(args):
+    from pysui import SuiConfig, SyncClient
+
+    cfg = SuiConfig.user_config(
+        rpc_url = args.rpc_url,
+        prv_keys = [args.prv_key] if args.prv_key else []
+    )
+    return SyncClient(cfg)
@@ -3,11 +3,8 @@ import json
 import argparse
 import os
 import time
-import pandas as pd
 
-column_names = ['balance', 'checkpoint', 'coin_object_id', 'version', 'digest', 'owner_type', 
-                'owner_address', 'initial_shared_version', 'previous_transaction', 
-                'coin_type', 'object_status', 'has_public_transfer', 'storage_rebate', 'bcs']
+from coin_db import column_names
 
 
 def get_coins(owner, url, coin_type="0x2::sui::SUI", cursor=None, limit=1000):
@@ -48,6 +45,24 @@ def fetch_coins(owner, url, coin_type="0x2::sui::SUI", cursor=None, limit=500):
         
 
 
+def write_csv(owner, url, filename='output.csv'):
+    import pandas as pd
+
+    data = fetch_coins(owner, url)
+    if not data:
+        # fetch_coins returns None for an owner without coins and when the first page fails.
+        raise ValueError(f"No coins fetched for {owner} from {url}, nothing written to {filename}")
+    df = pd.DataFrame(data)
+
+    df = df.rename(columns={'coinType': 'coin_type', 'coinObjectId': 'coin_object_id', 'previousTransaction': 'previous_transaction'})
+
+    # Same layout the csv loaders read, see coin_db.column_names
+    df = df[column_names]
+
+    # Write DataFrame to CSV
+    df.to_csv(filename, index=False, header=False)
+
+
 def main():    
     parser = argparse.ArgumentParser()
     parser.add_argument("--rpc-url", type=str, help="RPC URL to use", default="https://fullnode.testnet.sui.io:443")    
@@ -58,19 +73,7 @@ def main():
     os.makedirs("coins", exist_ok=True)
 
     start = time.time()
-    data = fetch_coins(args.owner, args.rpc_url)
-    df = pd.DataFrame(data)
-
-    df = df.rename(columns={'coinType': 'coin_type', 'coinObjectId': 'coin_object_id'})
-    for column in column_names:
-        if column not in df.columns:
-            df[column] = 'dummy_value'  # Replace 'dummy_value' with your actual dummy value
-
-    # Reorder columns to match column_names
-    df = df[column_names]
-
-    # Write DataFrame to CSV
-    df.to_csv('output.csv', index=False, header=False)
+    write_csv(args.owner, args.rpc_url)
     end = time.time()
     print(f"Time taken: {end - start} seconds")
 
@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+
+from pysui.sui.sui_builders.get_builders import GetMultipleTx, GetTx
+from pysui.sui.sui_types.collections import SuiArray
+from pysui.sui.sui_types.scalars import SuiString
+
+from metrics import metrics
+
+
+class FinalityTracker:
+    """Confirms transactions submitted with WaitForEffectsCert in the background.
+
+    Workers `track(digest, indices)` right after submission and move on to their next chunk. The
+    tracker polls the fullnode until each transaction is checkpointed and then pushes the final
+    `(status, error, indices)` onto `results_queue`, the same tuples `write_results` consumes.
+    Transactions that are still unknown after `timeout` seconds are recorded as `unconfirmed` with
+    the digest as the error so `--retry-failed` picks them up.
+
+    Pending digests are polled with `sui_multiGetTransactionBlocks`, `batch_size` at a time (the
+    fullnode's query limit is 50), so a poll costs one RPC per batch rather than one per lane.
+    """
+
+    def __init__(self, client, results_queue, poll_interval=1.0, timeout=120.0, batch_size=50):
+        self.client = client
+        self.batch_size = batch_size
+        self.results_queue = results_queue
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.submitted = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="finality")
+        metrics.watch_queue("finality", self.submitted)
+
+    def start(self):
+        self.thread.start()
+
+    def track(self, digest, indices):
+        self.submitted.put((digest, indices, time.time()))
+
+    def close(self):
+        self.submitted.put(None)
+        self.thread.join()
+
+    def run(self):
+        pending = []
+        closing = False
+        while not closing or pending:
+            deadline = time.time() + self.poll_interval
+            while not closing:
+                wait = deadline - time.time() if pending else None
+                if wait is not None and wait <= 0:
+                    break
+                try:
+                    item = self.submitted.get(timeout=wait)
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                else:
+                    pending.append(item)
+            pending = self.poll(pending)
+            if closing and pending:
+                time.sleep(self.poll_interval)
+
+    def poll(self, pending):
+        """Settle every checkpointed or timed out transaction in `pending`, return the rest."""
+        still_pending = []
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i+self.batch_size]
+            with metrics.timed("finality"):
+                result = self.client.execute(GetMultipleTx(
+                    digests=SuiArray([SuiString(digest) for digest, _, _ in batch]),
+                    options={"showEffects": True},
+                ))
+            if result.is_ok():
+                found = {tx.digest: tx for tx in result.result_data.transactions}
+                txs = [found.get(digest) for digest, _, _ in batch]
+            else:
+                # A digest the fullnode does not know yet fails the whole batch, look them up one by one.
+                txs = [self.get_tx(digest) for digest, _, _ in batch]
+            still_pending.extend(item for item, tx in zip(batch, txs) if not self.confirm(tx, *item))
+        return still_pending
+
+    def get_tx(self, digest):
+        with metrics.timed("finality"):
+            result = self.client.execute(
+                GetTx(digest=SuiString(digest), options={"showEffects": True})
+            )
+        return result.result_data if result.is_ok() else None
+
+    def confirm(self, tx, digest, indices, submitted_at):
+        if tx is not None and tx.checkpoint:
+            if tx.succeeded:
+                self.results_queue.put(('deleted', None, indices))
+            else:
+                self.results_queue.put(('execution_error', tx.status, indices))
+            return True
+        if time.time() - submitted_at > self.timeout:
+            self.results_queue.put(('unconfirmed', digest, indices))
+            return True
+        return False
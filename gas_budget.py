@@ -0,0 +1,92 @@
+import math
+import threading
+
+from metrics import metrics
+
+DEFAULT_GAS_BUDGET = "1000000"
+
+
+class GasBudgetCache:
+    """Gas budgets calibrated with one dry run per chunk shape.
+
+    A chunk's shape is the number of gas payment objects and whether every coin is in storage rebate
+    territory, i.e. worth less than the rebate for deleting it. Coins are smashed as gas payments
+    rather than with MergeCoins commands, so the payment count is also the merge input count. The
+    per coin rebate is learned from the first dry run. Later chunks of the same shape reuse the
+    cached budget without another RPC. A shape whose dry run fails `max_attempts` times, e.g. stale
+    coins on a retry pass, is cached at the default budget so it stops costing a dry run per chunk.
+    """
+
+    def __init__(self, margin=1.2, calibration_budget="50000000", max_attempts=3):
+        self.margin = margin
+        self.calibration_budget = calibration_budget
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.budgets = {}
+        self.failures = {}
+        self.coin_rebate = None
+
+    def shape(self, gas_objects):
+        coins = [coin for coin in gas_objects[1:] if not isinstance(coin, str)]
+        in_rebate_territory = (
+            self.coin_rebate is not None
+            and len(coins) == len(gas_objects) - 1
+            and all(int(coin.balance) < self.coin_rebate for coin in coins)
+        )
+        return (len(gas_objects), in_rebate_territory)
+
+    def budget_for(self, txn, gas_objects):
+        key = self.shape(gas_objects)
+        budget = self.budgets.get(key)
+        if budget is not None:
+            metrics.inc("gas_budget_cache_hits")
+            return budget
+        with self.lock:
+            budget = self.budgets.get(key)
+            if budget is None:
+                budget = self.calibrate(txn, gas_objects, key)
+        return budget
+
+    def calibrate(self, txn, gas_objects, key):
+        with metrics.timed("gas_calibrate"):
+            result = txn.dry_run_with_multiple_gas(
+                gas_budget=self.calibration_budget, use_gas_objects=gas_objects
+            )
+        if not result.is_ok() or not result.result_data.effects.status.succeeded:
+            metrics.inc("gas_budget_calibration_failures")
+            self.failures[key] = self.failures.get(key, 0) + 1
+            if self.failures[key] >= self.max_attempts:
+                print(f"Gas budget calibration failed {self.failures[key]} times for {key[0]} gas objects, rebate territory {key[1]}, using {DEFAULT_GAS_BUDGET}")
+                self.budgets[key] = DEFAULT_GAS_BUDGET
+            return DEFAULT_GAS_BUDGET
+        gas_used = result.result_data.effects.gas_used
+        budget = str(max(
+            math.ceil(gas_used.total * self.margin),
+            int(txn._current_gas_price) * 1000,
+        ))
+        if self.coin_rebate is None and len(gas_objects) > 1:
+            # Every payment but the primary gas object is deleted, the primary one is only mutated.
+            self.coin_rebate = int(gas_used.storage_rebate) // (len(gas_objects) - 1)
+        self.budgets[key] = budget
+        print(f"Calibrated gas budget {budget} for {len(gas_objects)} gas objects, rebate territory {key[1]}")
+        return budget
+
+    def planning_budget(self):
+        """Largest budget calibrated so far, what a planned chunk has to be able to pay for."""
+        with self.lock:
+            return max(self.budgets.values(), key=int, default=DEFAULT_GAS_BUDGET)
+
+
+def planning_budget(budget_cache):
+    return budget_cache.planning_budget() if budget_cache is not None else DEFAULT_GAS_BUDGET
+
+
+def add_arguments(parser):
+    parser.add_argument("--calibrate-gas", help="Calibrate the gas budget with a dry run per chunk shape instead of the fixed default.", action='store_true')
+    parser.add_argument("--gas-budget-margin", type=float, help="Multiplier applied to the dry run gas cost.", default=1.2)
+
+
+def from_args(args):
+    if not args.calibrate_gas:
+        return None
+    return GasBudgetCache(margin=args.gas_budget_margin)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""merge-coins: one entry point for fetching, ingesting, merging, repairing and benchmarking.
+
+Every subcommand imports only what it needs inside its handler, e.g. `merge --retry-failed`
+against an existing db never imports pandas or requests.
+"""
+import time
+
+started = time.perf_counter()
+
+import argparse
+
+import config
+
+
+def fetch(args):
+    from fetch_coins_to_csv import write_csv
+
+    start = time.time()
+    write_csv(args.owner, args.rpc_url, args.filename)
+    print(f"Time taken: {time.time() - start} seconds")
+
+
+def ingest(args):
+    from coin_db import setup_db
+
+    conn = setup_db(args.purge, args.filename, args.db)
+    (count,) = conn.execute("SELECT COUNT(*) FROM coins").fetchone()
+    conn.close()
+    print(f"{count} coins in {args.db}")
+
+
+def merge(args):
+    from merge_coins_v2_with_db import run
+
+    run(args)
+
+
+def split(args):
+    from sharded import split_db
+
+    for path in split_db(args.db, args.shards, args.purge, args.exclude_objects):
+        print(f"Wrote {path}")
+
+
+def merge_sharded(args):
+    from sharded import coordinate
+
+    coordinate(args)
+
+
+def repair(args):
+    import coin_db
+
+    conn = coin_db.connect(args.db)
+    if args.mark_deleted:
+        print(f"Marked {coin_db.mark_deleted(conn, args.mark_deleted)} coins deleted")
+    if args.refresh_failed:
+        refreshed, deleted = coin_db.refresh_failed(conn, config.make_client(args))
+        print(f"Refreshed {refreshed} coins, marked {deleted} deleted")
+    conn.close()
+
+
+def bench(args):
+    from fetch_coins_to_csv import get_coins
+
+    print(f"Startup: {(time.perf_counter() - started) * 1000:.0f}ms")
+    cursor = None
+    coins = 0
+    latencies = []
+    for _ in range(args.pages):
+        start = time.perf_counter()
+        response = get_coins(args.owner, args.rpc_url, cursor=cursor, limit=args.page_size)
+        latencies.append(time.perf_counter() - start)
+        coins += len(response['result']['data'])
+        cursor = response['result']['nextCursor']
+        if not response['result']['hasNextPage']:
+            break
+    total = sum(latencies)
+    print(f"{len(latencies)} pages, {coins} coins in {total:.2f}s: {total / len(latencies) * 1000:.0f}ms per page, {coins / total:.0f} coins/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="merge-coins")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = subparsers.add_parser("fetch", help="Fetch all coins for an owner into a csv.")
+    config.add_rpc_arguments(fetch_parser)
+    fetch_parser.add_argument("--owner", type=str, help="Owner address. str repr of SuiAddress.", required=True)
+    fetch_parser.add_argument("--filename", type=str, help="Filename to write.", default="output.csv")
+    fetch_parser.set_defaults(handler=fetch)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Load a csv from `fetch` into the db.")
+    config.add_ingest_arguments(ingest_parser)
+    ingest_parser.set_defaults(handler=ingest)
+
+    merge_parser = subparsers.add_parser("merge", help="Merge the coins in the db, see merge_coins_v2_with_db.py.")
+    config.add_rpc_arguments(merge_parser)
+    config.add_signer_arguments(merge_parser)
+    config.add_merge_arguments(merge_parser)
+    merge_parser.set_defaults(handler=merge)
+
+    split_parser = subparsers.add_parser("split", help="Split the db into one db per shard by object id prefix.")
+    config.add_db_arguments(split_parser)
+    split_parser.add_argument("--shards", type=int, help="Number of shards.", default=4)
+    split_parser.add_argument("--purge", help="Replace existing shard dbs.", action='store_true')
+    split_parser.add_argument("--exclude-objects", nargs='+', type=str, help="Coins left out of every shard, pass the gas objects of every host.", default=[])
+    split_parser.set_defaults(handler=split)
+
+    merge_sharded_parser = subparsers.add_parser("merge-sharded", help="Merge each shard from `split` in its own process.")
+    config.add_rpc_arguments(merge_sharded_parser)
+    config.add_signer_arguments(merge_sharded_parser)
+    config.add_merge_arguments(merge_sharded_parser)
+    config.add_shard_arguments(merge_sharded_parser)
+    merge_sharded_parser.set_defaults(handler=merge_sharded)
+
+    repair_parser = subparsers.add_parser("repair", help="Fix up coin state in the db after failed runs.")
+    config.add_rpc_arguments(repair_parser)
+    config.add_db_arguments(repair_parser)
+    repair_parser.add_argument("--mark-deleted", nargs='+', type=str, help="Object ids to mark deleted, e.g. from ObjectNotFound errors.", default=[])
+    repair_parser.add_argument("--refresh-failed", help="Re-read versions of failed coins and reset them for retry, mark missing ones deleted.", action='store_true')
+    repair_parser.set_defaults(handler=repair, prv_key=None)
+
+    bench_parser = subparsers.add_parser("bench", help="Measure startup and suix_getCoins page latency.")
+    config.add_rpc_arguments(bench_parser)
+    bench_parser.add_argument("--owner", type=str, help="Owner address. str repr of SuiAddress.", required=True)
+    bench_parser.add_argument("--pages", type=int, help="Pages to fetch.", default=10)
+    bench_parser.add_argument("--page-size", type=int, help="Coins per page.", default=250)
+    bench_parser.set_defaults(handler=bench)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,133 +3,21 @@ import json
 import argparse
 import queue
 import threading
-from typing import Union, Optional, List
-import base64
-import time
-import random
-
-from pysui import __version__, SuiConfig, SyncClient, SuiAddress, SuiRpcResult
-from pysui.sui.sui_txn import SyncTransaction
-from pysui.sui.sui_types import bcs
-from pysui.sui.sui_types.scalars import SuiString
-from pysui.sui.sui_txn.signing_ms import SigningMultiSig
-from pysui.sui.sui_txresults.single_tx import ObjectRead
-from pysui.sui.sui_builders.exec_builders import (
-    ExecuteTransaction,
-)
+from collections import deque
+
 from pysui.sui.sui_builders.base_builder import (
     SuiRequestType,
 )
 from pysui.sui.sui_txresults import SuiCoinObject
 
-class ModifiedSyncTransaction(SyncTransaction):
-    def execute_with_multiple_gas(
-        self,
-        *,
-        gas_budget: Optional[Union[str, SuiString]] = "1000000",
-        options: Optional[dict] = None,
-        use_gas_objects: Optional[List[Union[str, SuiCoinObject]]] = None,
-    ) -> Union[SuiRpcResult, ValueError]:
-        assert not self._executed, "Transaction already executed"
-        gas_budget = gas_budget if gas_budget else "1000000"
-        tx_b64 = base64.b64encode(
-            self._build_for_execute_multiple_gas(gas_budget, use_gas_objects).serialize()
-        ).decode()
-
-        exec_tx = ExecuteTransaction(
-            tx_bytes=tx_b64,
-            signatures=self.signer_block.get_signatures(
-                client=self.client, tx_bytes=tx_b64
-            ),
-            options=options,
-            request_type=SuiRequestType.WAITFORLOCALEXECUTION,
-        )        
-        iresult = self.client.execute(exec_tx)        
-        self._executed = True
-        return iresult
-
-    def _build_for_execute_multiple_gas(
-        self,
-        gas_budget: Union[str, SuiString],
-        use_gas_objects: Optional[List[Union[str, SuiCoinObject]]] = None,
-    ) -> Union[bcs.TransactionData, ValueError]:        
-        # Get the transaction body
-        tx_kind = self.raw_kind()        
-        # Resolve sender address for inspect
-        if self.signer_block.sender:
-            for_sender: Union[
-                SuiAddress, SigningMultiSig
-            ] = self.signer_block.sender
-            if not isinstance(for_sender, SuiAddress):
-                for_sender = for_sender.multi_sig.as_sui_address
-        else:
-            for_sender = self.client.config.active_address
-        gas_budget = (
-            gas_budget if isinstance(gas_budget, str) else gas_budget.value
-        )
-        # Total = computation_cost + non_refundable_storage_fee + storage_cost
-        # gas_budget = max(ispec.effects.gas_used.total, int(gas_budget))
-
-        # If user provided
-        if use_gas_objects:
-            gas_objects = []
-            for use_coin in use_gas_objects:
-                if isinstance(use_coin, str):                    
-                    max_retries = 5
-                    base_wait_time = random.uniform(0.1, 0.5)                    
-                    for i in range(max_retries):
-                        res = self.client.get_object(use_coin)
-                        if res.is_ok():
-                            object_read: ObjectRead = res.result_data
-                            use_coin = SuiCoinObject.from_read_object(object_read)
-                            break
-                        else:                            
-                            wait_time = base_wait_time * 2 ** i
-                            time.sleep(wait_time)
-                    else:
-                        raise ValueError(
-                            f"Failed to fetch use_gas_object {use_coin}, error: {res.result_string}"
-                        )
-                if use_coin.object_id in self.builder.objects_registry:                            
-                    raise ValueError(
-                        f"use_gas_object {use_coin.object_id} in use in transaction."
-                    )                            
-                gas_objects.append(
-                    bcs.ObjectReference(
-                        bcs.Address.from_str(use_coin.object_id),
-                        int(use_coin.version),
-                        bcs.Digest.from_str(use_coin.digest),
-                    )
-                )
-
-            gas_object = bcs.GasData(gas_objects,
-                bcs.Address.from_str(for_sender.owner),
-                int(self._current_gas_price),
-                int(gas_budget),
-            )
-        else:
-            # Fetch the payment
-            gas_object = self._sig_block.get_gas_object(
-                client=self.client,
-                budget=gas_budget,
-                objects_in_use=self.builder.objects_registry,
-                merge_coin=self._merge_gas,
-                gas_price=self._current_gas_price,
-            )
-        if isinstance(self.signer_block.sender, SuiAddress):
-            who_sends = self.signer_block.sender.address
-        else:
-            who_sends = self.signer_block.sender.signing_address
-        return bcs.TransactionData(
-            "V1",
-            bcs.TransactionDataV1(
-                tx_kind,
-                bcs.Address.from_str(who_sends),
-                gas_object,
-                bcs.TransactionExpiration("None"),
-            ),
-        )
-
+from metrics import metrics, add_arguments as add_metrics_arguments, start_reporting_from_args
+import profiling
+import gas_budget
+import planner
+import config
+from planner import plan_chunks
+from pipeline import Pipeline
+from merge_tx import gas_object_from_effects, merge_coins_helper
 
 def get_coins(owner, url, coin_type="0x2::sui::SUI", cursor=None, limit=1000):
     payload = {
@@ -139,83 +27,155 @@ def get_coins(owner, url, coin_type="0x2::sui::SUI", cursor=None, limit=1000):
         "params": [owner, coin_type, cursor, limit]
     }            
     headers = {'content-type': 'application/json'}
-    response = requests.post(url, data=json.dumps(payload), headers=headers).json()    
+    with metrics.timed("page_fetch"):
+        response = requests.post(url, data=json.dumps(payload), headers=headers).json()    
     return response
 
-def fetch_coins(coin_queue, gas_object, owner, url, coin_type="0x2::sui::SUI", cursor=None, limit=250): # programmable transaction block limit is 512, undershoot a little    
-    coins = []
-    seen = set([gas_object])
+def fetch_pages(owner, url, coin_type="0x2::sui::SUI", limit=250):
+    """Yield each page of coins from `suix_getCoins` as soon as it arrives."""
+    cursor = None
     while True:
         response = get_coins(owner, url, coin_type, cursor, limit)
-        if response:
-            fetched_coins = response['result']['data']
-            unique_coins = []            
-            for coin in fetched_coins:
-                if coin['coinObjectId'] not in seen:
-                    unique_coins.append(SuiCoinObject.from_dict(coin))
-                    seen.add(coin['coinObjectId'])
-            coins.extend(unique_coins)
-
-            has_next_page = response['result']['hasNextPage']
-            cursor = response['result']['nextCursor']
-            if not has_next_page or len(coins) >= limit:
-                # push to queue in chunks of limit
-                while len(coins) >= limit:
-                    coin_queue.put(coins[:limit])
-                    coins = coins[limit:]
-                if not has_next_page:
-                    if coins:
-                        coin_queue.put(coins) 
-                    coin_queue.put(None)
-                    break
-        else:
+        if not response or 'result' not in response:
+            raise Exception(f"Failed to fetch coins, response: {response}")
+        yield response['result']['data']
+        if not response['result']['hasNextPage']:
             break
+        cursor = response['result']['nextCursor']
+
+class CoinDecoder:
+    """Decode pages into SuiCoinObjects, dropping the gas objects and coins repeated across recent pages.
+
+    Only the ids of the last `window` pages are remembered so memory stays bounded on long runs.
+    """
+    def __init__(self, gas_objects, window=8):
+        self.gas_objects = set(gas_objects)
+        self.recent = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def __call__(self, page):
+        unique_coins = []
+        with self.lock:
+            page_ids = set()
+            for coin in page:
+                coin_id = coin['coinObjectId']
+                if coin_id in self.gas_objects or coin_id in page_ids or any(coin_id in ids for ids in self.recent):
+                    continue
+                page_ids.add(coin_id)
+                unique_coins.append(coin)
+            self.recent.append(page_ids)
+        if unique_coins:
+            return [[SuiCoinObject.from_dict(coin) for coin in unique_coins]]
+
+class Chunker:
+    """Regroup decoded coins into chunks of `size`. programmable transaction block limit is 512, undershoot a little.
+
+    With `plan_window`, coins are held until `plan_window` chunks' worth have arrived and that window
+    is planned cheapest first, see `planner.plan_chunks`.
+    """
+    def __init__(self, size=250, plan_window=0, budget_cache=None):
+        self.size = size
+        self.plan_window = plan_window
+        self.budget_cache = budget_cache
+        self.buffer = []
+
+    def plan(self, coins):
+        return plan_chunks(coins, self.size, gas_budget.planning_budget(self.budget_cache), balance_of=lambda coin: int(coin.balance))
+
+    def __call__(self, coins):
+        self.buffer.extend(coins)
+        if self.plan_window:
+            if len(self.buffer) < self.size * self.plan_window:
+                return None
+            window, self.buffer = self.buffer, []
+            return self.plan(window)
+        chunks = []
+        while len(self.buffer) >= self.size:
+            chunks.append(self.buffer[:self.size])
+            del self.buffer[:self.size]
+        return chunks
+
+    def flush(self):
+        if not self.buffer:
+            return None
+        if self.plan_window:
+            return self.plan(self.buffer)
+        return [self.buffer]
+
+class MergeExecutor:
+    """Build, sign and execute a chunk with a gas object checked out of a shared pool.
+
+    The signed bytes commit to the gas object's current version, so each gas object is a sequential
+    lane and transactions overlap across gas objects. With `fast_path`, the next version comes from
+    the effects instead of a `get_object` on the next build.
+    """
+    def __init__(self, client, signer, gas_objects, fast_path=False, budget_cache=None):
+        self.client = client
+        self.signer = signer
+        self.fast_path = fast_path
+        self.budget_cache = budget_cache
+        self.gas_pool = queue.Queue()
+        for gas_object in gas_objects:
+            self.gas_pool.put((gas_object, gas_object))
+
+    def __call__(self, coins_to_merge):
+        gas_object, use_gas_object = self.gas_pool.get()
+        try:
+            request_type = SuiRequestType.WAITFOREFFECTSCERT if self.fast_path else SuiRequestType.WAITFORLOCALEXECUTION
+            result = merge_coins_helper(coins_to_merge, self.client, self.signer, use_gas_object, request_type=request_type, budget_cache=self.budget_cache)
+            if self.fast_path:
+                use_gas_object = gas_object_from_effects(result)
+            return [('deleted', None, coins_to_merge)]
+        except Exception as e:
+            use_gas_object = gas_object
+            return [('failed', str(e), coins_to_merge)]
+        finally:
+            self.gas_pool.put((gas_object, use_gas_object))
+
+def record_result(result):
+    status, error, coins = result
+    if status != 'deleted':
+        print(f"{len(coins)} coins completed with status {status}: {error}")
 
-def merge_coins_helper(coins_to_merge: List[SuiCoinObject], client, signer, gas_object):        
-    txn = ModifiedSyncTransaction(client, initial_sender=SuiAddress(signer))        
-    gas_objects = [gas_object]
-    gas_objects.extend(coins_to_merge)
-    time.sleep(random.uniform(0, 0.1))    
-    try:
-        result = txn.execute_with_multiple_gas(use_gas_objects=gas_objects)
-        if not result.is_ok():
-            raise Exception(f"{result.result_string}")                    
-    except Exception as e:        
-        raise Exception(e)        
-
-def merge_coins(coin_queue, client, signer, gas_object):    
-    while True:
-        coins_to_merge: List[SuiCoinObject] = coin_queue.get()
-        if coins_to_merge is None:
-            break        
-        merge_coins_helper(coins_to_merge, client, signer, gas_object)
-        
 def main():    
     parser = argparse.ArgumentParser()
-    parser.add_argument("--rpc-url", type=str, help="RPC URL to use", default="https://fullnode.testnet.sui.io:443")
-    parser.add_argument("--prv-key", type=str, help="Private key to use. This should be the Keystore formatted private key. You can convert private key from wallet with `sui keytool convert <VALUE>`")
-    parser.add_argument("--signer", type=str, help="Signer address to use. str repr of SuiAddress.")
-    parser.add_argument("--gas-object", type=str, help="Gas object to use. str repr of ObjectID.")
+    config.add_rpc_arguments(parser)
+    config.add_signer_arguments(parser)
+    parser.add_argument("--gas-object", nargs='+', type=str, help="Gas objects to use, one execute lane each. str repr of ObjectIDs.")
+    parser.add_argument("--page-size", type=int, help="Coins per suix_getCoins page.", default=250)
+    parser.add_argument("--chunk-size", type=int, help="Coins merged per transaction.", default=250)
+    parser.add_argument("--buffer-size", type=int, help="Items buffered between pipeline stages.", default=4)
+    parser.add_argument("--decode-workers", type=int, help="Threads decoding and deduplicating pages.", default=1)
+    parser.add_argument("--execute-workers", type=int, help="Threads building, signing and executing. Defaults to one per gas object.", default=None)
+    parser.add_argument("--fast-path", help="Submit with WaitForEffectsCert and chain gas object versions from the effects.", action='store_true')
+    add_metrics_arguments(parser)
+    profiling.add_arguments(parser)
+    gas_budget.add_arguments(parser)
+    planner.add_arguments(parser)
+    parser.add_argument("--plan-window", type=int, help="With --order balance, chunks' worth of coins planned together.", default=40)
     args = parser.parse_args()
 
-    cfg = SuiConfig.user_config(
-        rpc_url = args.rpc_url,
-        prv_keys = [args.prv_key]        
-    )
-    client = SyncClient(cfg)
+    client = config.make_client(args)
     signer = args.signer
-    gas_object = args.gas_object
-                    
-    coin_queue = queue.Queue()
-
-    fetch_thread = threading.Thread(target=fetch_coins, args=(coin_queue, gas_object, signer, args.rpc_url))
-    merge_thread = threading.Thread(target=merge_coins, args=(coin_queue, client, signer, gas_object))
-
-    fetch_thread.start()
-    merge_thread.start()
-
-    fetch_thread.join()
-    merge_thread.join()
+    gas_objects = args.gas_object
+
+    budget_cache = gas_budget.from_args(args)
+    chunker = Chunker(args.chunk_size, args.plan_window if args.order == "balance" else 0, budget_cache)
+    executor = MergeExecutor(client, signer, gas_objects, args.fast_path, budget_cache)
+    pipeline = Pipeline(maxsize=args.buffer_size)
+    pipeline.add("fetch", lambda _: fetch_pages(signer, args.rpc_url, limit=args.page_size))
+    pipeline.add("decode", CoinDecoder(gas_objects), workers=args.decode_workers)
+    pipeline.add("chunk", chunker, flush=chunker.flush)
+    pipeline.add("execute", executor, workers=args.execute_workers or len(gas_objects))
+    pipeline.add("record", record_result)
+
+    stop_reporting = start_reporting_from_args(args)
+    stop_profiling = profiling.start_from_args(args)
+    try:
+        pipeline.run()
+    finally:
+        stop_profiling()
+        stop_reporting()
 
 if __name__ == "__main__":
     main()
@@ -5,34 +5,49 @@ from typing import List
 import ast
 
 import pandas as pd
-from pysui import __version__, SuiConfig, SyncClient
 from pysui.sui.sui_txresults import SuiCoinObject
 
-from merge_coins_pubsub_v2 import merge_coins_helper
+from merge_tx import merge_coins_helper
+from metrics import metrics, add_arguments as add_metrics_arguments, start_reporting_from_args
+import profiling
+import gas_budget
+import planner
+import config
+from planner import plan_chunks
+from coin_db import column_names
 
-def fetch_coins(queues, filename, gas_objects, chunksize=12500):
-    column_names = ['balance', 'coin_object_id', 'version', 'digest', 'previous_transaction', 'coin_type']    
+def count_coins(filename, gas_objects, chunksize=500000):
+    """Coins in the csv that are not gas objects, read one column at a time so the ETA is cheap to get."""
+    total = 0
+    for chunk in pd.read_csv(filename, names=column_names, usecols=['coin_object_id'], chunksize=chunksize):
+        total += int((~chunk['coin_object_id'].isin(gas_objects)).sum())
+    return total
+
+def fetch_coins(queues, filename, gas_objects, chunksize=12500, order="arrival", budget_cache=None):
     for chunk in pd.read_csv(filename, names=column_names, chunksize=chunksize):
         coins_to_merge = []
         chunk = chunk[~chunk['coin_object_id'].isin(gas_objects)]        
         data_list = chunk.to_dict('records')
-        for i in range(0, len(data_list), 250):
-            sub_chunk = data_list[i:i+250]
+        if order == "balance":
+            sub_chunks = plan_chunks(data_list, 250, gas_budget.planning_budget(budget_cache))
+        else:
+            sub_chunks = [data_list[i:i+250] for i in range(0, len(data_list), 250)]
+        for i, sub_chunk in enumerate(sub_chunks):
             coins_to_merge = [SuiCoinObject.from_dict(obj) for obj in sub_chunk]
-            queues[i // 250 % len(queues)].put(coins_to_merge)            
+            queues[i % len(queues)].put(coins_to_merge)            
 
     for q in queues:
         q.put(None)
 
     
 
-def process_coins(queue, dead_letter_queue, client, signer, gas_object):
+def process_coins(queue, dead_letter_queue, client, signer, gas_object, budget_cache=None):
     while True:
         coins_to_merge: List[SuiCoinObject] = queue.get()
         if coins_to_merge is None:
             break
         try:
-            merge_coins_helper(coins_to_merge, client, signer, gas_object)
+            merge_coins_helper(coins_to_merge, client, signer, gas_object, budget_cache=budget_cache)
         except Exception as e:
             if "Transaction has non recoverable errors from at least 1/3 of validators" not in str(e):            
                 dead_letter_queue.put((e, coins_to_merge))
@@ -45,34 +60,43 @@ def process_coins(queue, dead_letter_queue, client, signer, gas_object):
     
 def main():    
     parser = argparse.ArgumentParser()
-    parser.add_argument("--rpc-url", type=str, help="RPC URL to use", default="https://fullnode.testnet.sui.io:443")
-    parser.add_argument("--prv-key", type=str, help="Private key to use. This should be the Keystore formatted private key. You can convert private key from wallet with `sui keytool convert <VALUE>`")
-    parser.add_argument("--signer", type=str, help="Signer address to use. str repr of SuiAddress.")
+    config.add_rpc_arguments(parser)
+    config.add_signer_arguments(parser)
     parser.add_argument("--gas-objects", nargs='+', type=str, help="Gas objects to use. str repr of ObjectIDs.")    
     parser.add_argument("--filename", type=str, help="Filename to use.", default="output.csv")
+    add_metrics_arguments(parser)
+    profiling.add_arguments(parser)
+    gas_budget.add_arguments(parser)
+    planner.add_arguments(parser)
     args = parser.parse_args()
 
-    cfg = SuiConfig.user_config(
-        rpc_url = args.rpc_url,
-        prv_keys = [args.prv_key]        
-    )
-    client = SyncClient(cfg)
+    client = config.make_client(args)
     signer = args.signer
     gas_objects = args.gas_objects
                     
     queues = [queue.Queue() for _ in range(len(gas_objects))]
     dead_letter_queue = queue.Queue()
+    for i, q in enumerate(queues):
+        metrics.watch_queue(f"worker_{i}", q)
+    metrics.watch_queue("dead_letter", dead_letter_queue)
+    stop_reporting = start_reporting_from_args(args)
+    stop_profiling = profiling.start_from_args(args)
 
-    consumer_threads = [threading.Thread(target=process_coins, args=(q, dead_letter_queue, client, signer, gas_objects[i])) for i, q in enumerate(queues)]
+    budget_cache = gas_budget.from_args(args)
+    consumer_threads = [threading.Thread(target=process_coins, args=(q, dead_letter_queue, client, signer, gas_objects[i], budget_cache), name=f"worker_{i}") for i, q in enumerate(queues)]
     for t in consumer_threads:
         t.start()
 
-    producer_thread = threading.Thread(target=fetch_coins, args=(queues, args.filename, gas_objects))
+    # Counted alongside the run so merging starts right away, the ETA shows up once it is known.
+    threading.Thread(target=lambda: metrics.set_total(count_coins(args.filename, gas_objects)), name="counter", daemon=True).start()
+    producer_thread = threading.Thread(target=fetch_coins, args=(queues, args.filename, gas_objects), kwargs={"order": args.order, "budget_cache": budget_cache}, name="producer")
     producer_thread.start()        
 
     producer_thread.join()
     for t in consumer_threads:
         t.join()
+    stop_profiling()
+    stop_reporting()
 
     counter = 0
     while not dead_letter_queue.empty():
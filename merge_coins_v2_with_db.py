@@ -1,67 +1,62 @@
 import argparse
 import queue
 import threading
-import sqlite3
 from sqlite3 import Connection
 import json
 import ast
 
 
-import pandas as pd
-from pysui import __version__, SuiConfig, SyncClient
 from pysui.sui.sui_txresults import SuiCoinObject
-
-from merge_coins_pubsub_v2 import merge_coins_helper
-
-def setup_db(purge, filename):
-    conn = sqlite3.connect("coins_data.db", check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='coins'")
-    
-    if cursor.fetchone():
-        if purge:                        
-            conn.execute("DROP TABLE coins")
-        else:            
-            return conn
-        
-    column_names = ['balance', 'coin_object_id', 'version', 'digest', 'previous_transaction', 'coin_type']
-
-    df = pd.read_csv(filename, chunksize=50000, names=column_names)
-    for chunk in df:
-        chunk.to_sql('coins', conn, if_exists='append', index_label='idx')
-
-    conn.execute("ALTER TABLE coins ADD COLUMN status TEXT")
-    conn.execute("ALTER TABLE coins ADD COLUMN error TEXT")
-    conn.commit()
-    return conn    
-
-
-def fetch_coins(queues, results_queue, conn: Connection, gas_objects, retry_failed=False, chunksize=250):
+from pysui.sui.sui_builders.base_builder import SuiRequestType
+
+from merge_tx import merge_coins_helper, gas_object_from_effects
+from finality import FinalityTracker
+from metrics import metrics, start_reporting_from_args
+import profiling
+import gas_budget
+from planner import plan_chunks
+import config
+from coin_db import setup_db, create_balance_index
+
+def fetch_coins(queues, results_queue, conn: Connection, gas_objects, retry_failed=False, chunksize=250, order="arrival", budget_cache=None):
     db_idx = 0
+    db_balance = -1
     cursor = conn.cursor()    
     gas_objects_placeholders = ', '.join(['?' for _ in gas_objects])    
     status_filter = 'status IS NULL' if not retry_failed else "status IS NULL or status != 'deleted'"
-    fetch_query = f"SELECT * FROM coins WHERE {status_filter} AND coin_object_id NOT IN ({gas_objects_placeholders}) AND idx > ? ORDER BY idx ASC LIMIT ?"
+    fetch_query = f"SELECT * FROM coins WHERE ({status_filter}) AND coin_object_id NOT IN ({gas_objects_placeholders}) AND idx > ? ORDER BY idx ASC LIMIT ?"
+    if order == "balance":
+        # Keyset pagination over (balance, idx) so the whole table is walked cheapest coin first. The
+        # `>=` on balance alone lets sqlite seek ix_coins_balance_idx instead of scanning it.
+        create_balance_index(conn)
+        fetch_query = f"SELECT * FROM coins WHERE ({status_filter}) AND coin_object_id NOT IN ({gas_objects_placeholders}) AND CAST(balance AS INTEGER) >= ? AND (CAST(balance AS INTEGER), idx) > (?, ?) ORDER BY CAST(balance AS INTEGER) ASC, idx ASC LIMIT ?"
     fetch_amount = len(queues) * chunksize                
+    count_query = f"SELECT COUNT(*) FROM coins WHERE ({status_filter}) AND coin_object_id NOT IN ({gas_objects_placeholders})"
+    cursor.execute(count_query, gas_objects)
+    metrics.set_total(cursor.fetchone()[0])
     while True:        
-        params = gas_objects + [db_idx, fetch_amount]
+        if order == "balance":
+            params = gas_objects + [db_balance, db_balance, db_idx, fetch_amount]
+        else:
+            params = gas_objects + [db_idx, fetch_amount]
         cursor.execute(fetch_query, params)        
         data_list = [dict(row) for row in cursor.fetchall()]            
         if not data_list:                        
             break
         db_idx = data_list[-1]['idx']
-        coins_to_merge = [SuiCoinObject.from_dict(obj) for obj in data_list]
-        indices = [obj['idx'] for obj in data_list]        
+        if order == "balance":
+            db_balance = int(data_list[-1]['balance'])
+            chunks = plan_chunks(data_list, chunksize, gas_budget.planning_budget(budget_cache))
+        else:
+            chunks = [data_list[i:i+chunksize] for i in range(0, len(data_list), chunksize)]
 
-        for i in range(0, len(data_list), chunksize):            
-            queues[i // chunksize % len(queues)].put((
-                indices[i:i+chunksize],
-                coins_to_merge[i:i+chunksize]
+        for i, chunk in enumerate(chunks):            
+            queues[i % len(queues)].put((
+                [obj['idx'] for obj in chunk],
+                [SuiCoinObject.from_dict(obj) for obj in chunk]
             ))
                                     
-        results_queue.put(('processing', None, indices))         
+        results_queue.put(('processing', None, [obj['idx'] for obj in data_list]))         
     for q in queues:
         q.put(None)
 
@@ -85,19 +80,31 @@ def write_results(results_queue, conn):
         else:
             query = f"UPDATE coins SET status = '{status}', error = ? WHERE idx IN ({placeholders})"
             params = [error] + indices            
-        cursor.execute(query, params)
-        conn.commit()
-
-def process_coins(read_queue, results_queue, client, signer, gas_object):
+        with metrics.timed("db_write"):
+            cursor.execute(query, params)
+            conn.commit()
+        metrics.inc(f"coins_{status}", len(indices))
+
+def process_coins(read_queue, results_queue, client, signer, gas_object, tracker=None, budget_cache=None):
+    # With a tracker, transactions only wait for the effects certificate. The gas object's next
+    # version comes from those effects and the tracker records the final status in the background.
+    use_gas_object = gas_object
     while True:
         data = read_queue.get()
         if data is None:
             break
         (indices, coins_to_merge) = data        
         try:
-            merge_coins_helper(coins_to_merge, client, signer, gas_object)
-            results_queue.put(('deleted', None, indices))
+            if tracker is None:
+                merge_coins_helper(coins_to_merge, client, signer, gas_object, budget_cache=budget_cache)
+                results_queue.put(('deleted', None, indices))
+            else:
+                result = merge_coins_helper(coins_to_merge, client, signer, use_gas_object, request_type=SuiRequestType.WAITFOREFFECTSCERT, budget_cache=budget_cache)
+                use_gas_object = gas_object_from_effects(result)
+                tracker.track(result.result_data.digest, indices)
         except Exception as e:
+            # The gas object version is unknown after a failure, fetch it again on the next chunk.
+            use_gas_object = gas_object
             error_message = str(e)
             error_type = None
             if "Transaction has non recoverable errors from at least 1/3 of validators" in error_message:                    
@@ -128,41 +135,41 @@ def process_coins(read_queue, results_queue, client, signer, gas_object):
                 error_type = "other_error"
                 results_queue.put((error_type, error_message, indices))                
                 
-def main():    
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--rpc-url", type=str, help="RPC URL to use", default="https://fullnode.testnet.sui.io:443")
-    parser.add_argument("--prv-key", type=str, help="Private key to use. This should be the Keystore formatted private key. You can convert private key from wallet with `sui keytool convert <VALUE>`")
-    parser.add_argument("--signer", type=str, help="Signer address to use. str repr of SuiAddress.")
-    parser.add_argument("--gas-objects", nargs='+', type=str, help="Gas objects to use. str repr of ObjectIDs.")    
-    parser.add_argument("--filename", type=str, help="Filename to use.", default="output.csv")
-    parser.add_argument("--purge", help="Whether to purge the table if it exists.", action='store_true')
-    parser.add_argument("--retry-failed", help="Whether to retry failed coins.", action='store_true')
-    args = parser.parse_args()
-
-    cfg = SuiConfig.user_config(
-        rpc_url = args.rpc_url,
-        prv_keys = [args.prv_key]        
-    )
-    client = SyncClient(cfg)
+def run(args, conn=None):
+    client = config.make_client(args)
     signer = args.signer
     gas_objects = args.gas_objects
+    # Coins that must never be merged into another transaction's gas payment.
+    excluded_objects = gas_objects + [obj for obj in args.exclude_objects if obj not in gas_objects]
                     
     queues = [queue.Queue() for _ in range(len(gas_objects))]    
     results_queue = queue.Queue()
-    print("Setting up db")
-    conn = setup_db(args.purge, args.filename)
-    print("db setup complete")
+    for i, q in enumerate(queues):
+        metrics.watch_queue(f"worker_{i}", q)
+    metrics.watch_queue("results", results_queue)
+    if conn is None:
+        print("Setting up db")
+        conn = setup_db(args.purge, args.filename, args.db)
+        print("db setup complete")
 
     print("Gas smashing...")
+    stop_reporting = start_reporting_from_args(args)
+    stop_profiling = profiling.start_from_args(args)
     try:
-        writer_thread = threading.Thread(target=write_results, args=(results_queue, conn))
+        writer_thread = threading.Thread(target=write_results, args=(results_queue, conn), name="writer")
         writer_thread.start()
 
-        consumer_threads = [threading.Thread(target=process_coins, args=(q, results_queue, client, signer, gas_objects[i])) for i, q in enumerate(queues)]
+        tracker = None
+        if args.fast_path:
+            tracker = FinalityTracker(client, results_queue, timeout=args.finality_timeout)
+            tracker.start()
+
+        budget_cache = gas_budget.from_args(args)
+        consumer_threads = [threading.Thread(target=process_coins, args=(q, results_queue, client, signer, gas_objects[i], tracker, budget_cache), name=f"worker_{i}") for i, q in enumerate(queues)]
         for t in consumer_threads:
             t.start()
 
-        producer_thread = threading.Thread(target=fetch_coins, args=(queues, results_queue, conn, gas_objects, args.retry_failed))
+        producer_thread = threading.Thread(target=fetch_coins, args=(queues, results_queue, conn, excluded_objects, args.retry_failed), kwargs={"order": args.order, "budget_cache": budget_cache}, name="producer")
         producer_thread.start()            
     finally:
         print("Gas smashing complete. Cleaning up...")
@@ -170,8 +177,20 @@ def main():
         producer_thread.join()
         for t in consumer_threads:
             t.join()    
+        if tracker is not None:
+            tracker.close()
         results_queue.put((None, None, None))
         writer_thread.join()    
+        stop_profiling()
+        stop_reporting()
         conn.close()            
+
+def main():    
+    parser = argparse.ArgumentParser()
+    config.add_rpc_arguments(parser)
+    config.add_signer_arguments(parser)
+    config.add_merge_arguments(parser)
+    run(parser.parse_args())
+
 if __name__ == "__main__":
     main()    
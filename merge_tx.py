@@ -0,0 +1,184 @@
+from typing import Union, Optional, List
+import base64
+import time
+import random
+
+from pysui import SuiAddress, SuiRpcResult
+from pysui.sui.sui_txn import SyncTransaction
+from pysui.sui.sui_types import bcs
+from pysui.sui.sui_types.scalars import SuiString
+from pysui.sui.sui_txn.signing_ms import SigningMultiSig
+from pysui.sui.sui_txresults.single_tx import ObjectRead
+from pysui.sui.sui_builders.exec_builders import (
+    DryRunTransaction,
+    ExecuteTransaction,
+)
+from pysui.sui.sui_builders.base_builder import (
+    SuiRequestType,
+)
+from pysui.sui.sui_txresults import SuiCoinObject
+
+from metrics import metrics
+import profiling
+
+class ModifiedSyncTransaction(SyncTransaction):
+    def execute_with_multiple_gas(
+        self,
+        *,
+        gas_budget: Optional[Union[str, SuiString]] = "1000000",
+        options: Optional[dict] = None,
+        use_gas_objects: Optional[List[Union[str, SuiCoinObject]]] = None,
+        request_type: SuiRequestType = SuiRequestType.WAITFORLOCALEXECUTION,
+    ) -> Union[SuiRpcResult, ValueError]:
+        assert not self._executed, "Transaction already executed"
+        gas_budget = gas_budget if gas_budget else "1000000"
+        if options is None and request_type == SuiRequestType.WAITFOREFFECTSCERT:
+            # The fullnode rejects WaitForEffectsCert with pysui's default options, which ask for
+            # object and balance changes. The effects carry the next gas object version.
+            options = {"showEffects": True}
+        with metrics.timed("build_sign", exclude=("gas_resolve",)):
+            with profiling.span("build"):
+                tx_data = self._build_for_execute_multiple_gas(gas_budget, use_gas_objects)
+            with profiling.span("serialize"):
+                tx_b64 = base64.b64encode(tx_data.serialize()).decode()
+            with profiling.span("sign"):
+                signatures = self.signer_block.get_signatures(
+                    client=self.client, tx_bytes=tx_b64
+                )
+            exec_tx = ExecuteTransaction(
+                tx_bytes=tx_b64,
+                signatures=signatures,
+                options=options,
+                request_type=request_type,
+            )
+        with metrics.timed("execute"):
+            iresult = self.client.execute(exec_tx)
+        self._executed = True
+        return iresult
+
+    def dry_run_with_multiple_gas(
+        self,
+        *,
+        gas_budget: Union[str, SuiString],
+        use_gas_objects: Optional[List[Union[str, SuiCoinObject]]] = None,
+    ) -> SuiRpcResult:
+        tx_b64 = base64.b64encode(
+            self._build_for_execute_multiple_gas(gas_budget, use_gas_objects).serialize()
+        ).decode()
+        return self.client.execute(DryRunTransaction(tx_bytes=tx_b64))
+
+    def _build_for_execute_multiple_gas(
+        self,
+        gas_budget: Union[str, SuiString],
+        use_gas_objects: Optional[List[Union[str, SuiCoinObject]]] = None,
+    ) -> Union[bcs.TransactionData, ValueError]:        
+        # Get the transaction body
+        tx_kind = self.raw_kind()        
+        # Resolve sender address for inspect
+        if self.signer_block.sender:
+            for_sender: Union[
+                SuiAddress, SigningMultiSig
+            ] = self.signer_block.sender
+            if not isinstance(for_sender, SuiAddress):
+                for_sender = for_sender.multi_sig.as_sui_address
+        else:
+            for_sender = self.client.config.active_address
+        gas_budget = (
+            gas_budget if isinstance(gas_budget, str) else gas_budget.value
+        )
+        # Total = computation_cost + non_refundable_storage_fee + storage_cost
+        # No inspection here, see gas_budget.GasBudgetCache for dry run calibrated budgets.
+
+        # If user provided
+        if use_gas_objects:
+            gas_objects = []
+            for use_coin in use_gas_objects:
+                if isinstance(use_coin, str):                    
+                    max_retries = 5
+                    base_wait_time = random.uniform(0.1, 0.5)                    
+                    for i in range(max_retries):
+                        with metrics.timed("gas_resolve"):
+                            res = self.client.get_object(use_coin)
+                        if res.is_ok():
+                            object_read: ObjectRead = res.result_data
+                            use_coin = SuiCoinObject.from_read_object(object_read)
+                            break
+                        else:                            
+                            wait_time = base_wait_time * 2 ** i
+                            time.sleep(wait_time)
+                    else:
+                        raise ValueError(
+                            f"Failed to fetch use_gas_object {use_coin}, error: {res.result_string}"
+                        )
+                if use_coin.object_id in self.builder.objects_registry:                            
+                    raise ValueError(
+                        f"use_gas_object {use_coin.object_id} in use in transaction."
+                    )                            
+                gas_objects.append(
+                    bcs.ObjectReference(
+                        bcs.Address.from_str(use_coin.object_id),
+                        int(use_coin.version),
+                        bcs.Digest.from_str(use_coin.digest),
+                    )
+                )
+
+            gas_object = bcs.GasData(gas_objects,
+                bcs.Address.from_str(for_sender.owner),
+                int(self._current_gas_price),
+                int(gas_budget),
+            )
+        else:
+            # Fetch the payment
+            gas_object = self._sig_block.get_gas_object(
+                client=self.client,
+                budget=gas_budget,
+                objects_in_use=self.builder.objects_registry,
+                merge_coin=self._merge_gas,
+                gas_price=self._current_gas_price,
+            )
+        if isinstance(self.signer_block.sender, SuiAddress):
+            who_sends = self.signer_block.sender.address
+        else:
+            who_sends = self.signer_block.sender.signing_address
+        return bcs.TransactionData(
+            "V1",
+            bcs.TransactionDataV1(
+                tx_kind,
+                bcs.Address.from_str(who_sends),
+                gas_object,
+                bcs.TransactionExpiration("None"),
+            ),
+        )
+
+
+def gas_object_from_effects(result: SuiRpcResult) -> SuiCoinObject:
+    """The gas object as of after `result`, read from its effects so the next transaction skips `get_object`."""
+    tx_response = result.result_data
+    reference = tx_response.effects.gas_object.reference
+    # Only the object reference is used when building the gas payment, the balance is not tracked.
+    return SuiCoinObject(
+        coin_type="0x2::coin::Coin<0x2::sui::SUI>",
+        coin_object_id=reference.object_id,
+        version=str(reference.version),
+        digest=reference.digest,
+        balance="0",
+        previous_transaction=tx_response.digest,
+    )
+
+def merge_coins_helper(coins_to_merge: List[SuiCoinObject], client, signer, gas_object, request_type=SuiRequestType.WAITFORLOCALEXECUTION, budget_cache=None):        
+    txn = ModifiedSyncTransaction(client, initial_sender=SuiAddress(signer))        
+    gas_objects = [gas_object]
+    gas_objects.extend(coins_to_merge)
+    time.sleep(random.uniform(0, 0.1))    
+    try:
+        budget = budget_cache.budget_for(txn, gas_objects) if budget_cache else None
+        result = txn.execute_with_multiple_gas(gas_budget=budget, use_gas_objects=gas_objects, request_type=request_type)
+        if not result.is_ok():
+            raise Exception(f"{result.result_string}")                    
+    except Exception as e:        
+        metrics.inc("transactions_failed")
+        metrics.inc("coins_failed", len(coins_to_merge))
+        raise Exception(e)        
+    metrics.coins_completed(len(coins_to_merge))
+    metrics.inc("transactions_succeeded")
+    return result
@@ -0,0 +1,267 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import profiling
+
+STAGES = ("page_fetch", "gas_resolve", "build_sign", "execute", "db_write")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """Thread-safe counters, per-stage latency histograms and queue depth gauges.
+
+    Stage timings are recorded with `timed(stage)`; merged coins with `coins_completed(n)`, coins
+    in failed transactions only go to the `coins_failed` counter. The rolling coins-per-second
+    figure is computed over the last `window` seconds.
+    """
+
+    def __init__(self, window=60.0):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.window = window
+        self.counters = {}
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.stage_threads = {stage: set() for stage in STAGES}
+        self.queues = {}
+        self.coins_total = None
+        self.coins_done = 0
+        self.samples = deque([(self.started, 0)])
+        self.local = threading.local()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+                self.stage_threads[stage] = set()
+            self.histograms[stage].observe(seconds)
+            self.stage_threads[stage].add(threading.get_ident())
+
+    @contextmanager
+    def timed(self, stage, exclude=()):
+        """Record the time spent in the block under `stage`.
+
+        Time spent in nested `timed` blocks for any of the `exclude` stages on the same thread is
+        subtracted, e.g. `build_sign` does not count the `gas_resolve` lookups made while building.
+        """
+        frames = getattr(self.local, "frames", None)
+        if frames is None:
+            frames = self.local.frames = []
+        frame = [stage, exclude, 0.0]
+        frames.append(frame)
+        start = time.perf_counter()
+        try:
+            with profiling.span(stage):
+                yield
+        except BaseException:
+            self.inc(f"{stage}_errors")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            frames.pop()
+            for outer in frames:
+                if stage in outer[1]:
+                    outer[2] += elapsed
+            self.observe(stage, elapsed - frame[2])
+
+    def watch_queue(self, name, q):
+        with self.lock:
+            self.queues[name] = q
+
+    def set_total(self, total):
+        with self.lock:
+            self.coins_total = total
+
+    def coins_completed(self, n):
+        now = time.time()
+        with self.lock:
+            self.coins_done += n
+            self.samples.append((now, self.coins_done))
+            while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+                self.samples.popleft()
+
+    def rate(self):
+        now = time.time()
+        with self.lock:
+            first_t, first_done = self.samples[0]
+            done = self.coins_done
+        elapsed = now - first_t
+        return (done - first_done) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        rate = self.rate()
+        with self.lock:
+            remaining = None if self.coins_total is None else self.coins_total - self.coins_done
+        if remaining is None or rate <= 0:
+            return None
+        return max(remaining, 0) / rate
+
+    def bottleneck(self):
+        """Stage whose threads are busiest, as a fraction of the run time of the threads running it.
+
+        Busy time is divided by the number of threads that recorded the stage, so a stage spread
+        over many workers is not ranked above a saturated single threaded one.
+        """
+        elapsed = time.time() - self.started
+        with self.lock:
+            utilisation = {
+                stage: h.sum / (len(self.stage_threads[stage]) * elapsed)
+                for stage, h in self.histograms.items() if h.count
+            }
+        if not utilisation or elapsed <= 0:
+            return None, 0.0
+        stage = max(utilisation, key=utilisation.get)
+        return stage, min(utilisation[stage], 1.0)
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            lines.append("# TYPE merge_coins_completed_total counter")
+            lines.append(f"merge_coins_completed_total {self.coins_done}")
+            if self.coins_total is not None:
+                lines.append("# TYPE merge_coins_total gauge")
+                lines.append(f"merge_coins_total {self.coins_total}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE merge_{name}_total counter")
+                lines.append(f"merge_{name}_total {value}")
+            lines.append("# TYPE merge_stage_seconds histogram")
+            for stage, h in self.histograms.items():
+                cumulative = 0
+                for upper, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'merge_stage_seconds_bucket{{stage="{stage}",le="{upper}"}} {cumulative}')
+                lines.append(f'merge_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'merge_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'merge_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            lines.append("# TYPE merge_queue_depth gauge")
+            for name, q in self.queues.items():
+                lines.append(f'merge_queue_depth{{queue="{name}"}} {q.qsize()}')
+        lines.append("# TYPE merge_coins_per_second gauge")
+        lines.append(f"merge_coins_per_second {self.rate()}")
+        eta = self.eta()
+        if eta is not None:
+            lines.append("# TYPE merge_eta_seconds gauge")
+            lines.append(f"merge_eta_seconds {eta}")
+        return "\n".join(lines) + "\n"
+
+    def status_line(self):
+        with self.lock:
+            done = self.coins_done
+            total = self.coins_total
+            depths = " ".join(f"{name}={q.qsize()}" for name, q in self.queues.items())
+            stages = " ".join(
+                f"{stage}={h.sum / h.count * 1000:.0f}ms"
+                for stage, h in self.histograms.items() if h.count
+            )
+        eta = self.eta()
+        stage, share = self.bottleneck()
+        parts = [
+            f"[{time.time() - self.started:.0f}s]",
+            f"coins {done}" + (f"/{total}" if total is not None else ""),
+            f"{self.rate():.1f}/s",
+            f"eta {format_seconds(eta)}",
+        ]
+        if depths:
+            parts.append(f"queues {depths}")
+        if stages:
+            parts.append(f"avg {stages}")
+        if stage:
+            parts.append(f"bottleneck {stage} ({share:.0%} busy)")
+        return " | ".join(parts)
+
+    def write_file(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{hours}h{minutes:02d}m{secs:02d}s" if hours else f"{minutes}m{secs:02d}s"
+
+
+# Shared by every script in the process.
+metrics = Metrics()
+
+
+def add_arguments(parser):
+    parser.add_argument("--metrics-file", type=str, help="Write Prometheus text format metrics to this file.", default=None)
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus text format metrics on this port.", default=None)
+    parser.add_argument("--status-interval", type=float, help="Seconds between console status lines. 0 disables.", default=10.0)
+
+
+def start_reporting(metrics_file=None, metrics_port=None, interval=10.0):
+    """Start the console status line, metrics file writer and HTTP endpoint. Returns a stop function."""
+    stop_event = threading.Event()
+    server = None
+
+    if metrics_port is not None:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("", metrics_port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def report():
+        if interval:
+            print(metrics.status_line(), flush=True)
+        if metrics_file:
+            metrics.write_file(metrics_file)
+
+    def loop():
+        while not stop_event.wait(interval or 10.0):
+            report()
+
+    reporter = threading.Thread(target=loop, daemon=True)
+    reporter.start()
+
+    def stop():
+        stop_event.set()
+        reporter.join()
+        report()
+        if server is not None:
+            server.shutdown()
+
+    return stop
+
+
+def start_reporting_from_args(args):
+    return start_reporting(args.metrics_file, args.metrics_port, args.status_interval)
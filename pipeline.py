@@ -0,0 +1,100 @@
+import queue
+import threading
+
+from metrics import metrics
+
+_STOP = object()
+
+
+class Stage:
+    """One step of a `Pipeline`, run by `workers` threads reading from a bounded inbox.
+
+    `func(item)` returns an iterable of items for the next stage (or None). `flush()`, if given,
+    runs once after every worker has finished and may also return items, e.g. a partial chunk.
+    """
+
+    def __init__(self, name, func, workers=1, flush=None, maxsize=4, cancel=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.flush = flush
+        self.inbox = queue.Queue(maxsize=maxsize)
+        self.remaining = workers
+        self.lock = threading.Lock()
+        self.threads = []
+        self.error = None
+        self.cancel = cancel if cancel is not None else threading.Event()
+
+    def start(self, downstream):
+        self.threads = [
+            threading.Thread(target=self.run, args=(downstream,), name=f"{self.name}_{i}")
+            for i in range(self.workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def emit(self, downstream, items):
+        if downstream is None or items is None:
+            return
+        for item in items:
+            if self.cancel.is_set():
+                break
+            downstream.inbox.put(item)
+
+    def run(self, downstream):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                break
+            if self.cancel.is_set():
+                # Keep draining so upstream stages never block on a full inbox.
+                continue
+            try:
+                self.emit(downstream, self.func(item))
+            except Exception as e:
+                print(f"Stage {self.name} failed: {e}")
+                self.error = e
+                self.cancel.set()
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            if self.flush is not None and not self.cancel.is_set():
+                self.emit(downstream, self.flush())
+            if downstream is not None:
+                for _ in range(downstream.workers):
+                    downstream.inbox.put(_STOP)
+
+
+class Pipeline:
+    """Stages connected by bounded queues, each stage running concurrently with the others.
+
+    The first stage is called once with None and is expected to be a generator producing the work.
+    Memory is bounded by `maxsize` items per stage inbox. An exception in any stage cancels the
+    rest of the run and is re-raised from `run()`.
+    """
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.stages = []
+        self.cancel = threading.Event()
+
+    def add(self, name, func, workers=1, flush=None):
+        stage = Stage(name, func, workers, flush, self.maxsize, self.cancel)
+        metrics.watch_queue(name, stage.inbox)
+        self.stages.append(stage)
+        return self
+
+    def run(self):
+        for stage, downstream in zip(self.stages, self.stages[1:] + [None]):
+            stage.start(downstream)
+        first = self.stages[0]
+        first.inbox.put(None)
+        for _ in range(first.workers):
+            first.inbox.put(_STOP)
+        for stage in self.stages:
+            for t in stage.threads:
+                t.join()
+        errors = [stage.error for stage in self.stages if stage.error is not None]
+        if errors:
+            raise errors[0]
@@ -0,0 +1,35 @@
+def record_balance(coin):
+    return int(coin['balance'])
+
+
+def plan_chunks(coins, chunk_size, gas_budget, balance_of=record_balance):
+    """Order coins cheapest first and group them into chunks that can pay for themselves.
+
+    Coins are sorted by balance so dust is smashed first. `suix_getCoins` does not return storage
+    rebates, so the ordering cannot account for them. Smashing a chunk pays its gas from the sum
+    of the chunk's balances, so a chunk of dust that cannot cover `gas_budget` is topped up with the
+    largest coins left, taken from the other end of the ordering.
+    """
+    ordered = sorted(coins, key=balance_of)
+    budget = int(gas_budget)
+    lo, hi = 0, len(ordered)
+    chunks = []
+    while lo < hi:
+        chunk = []
+        funds = 0
+        while lo < hi and len(chunk) < chunk_size:
+            if funds < budget and len(chunk) == chunk_size - 1:
+                # Last slot and still short: spend it on the largest coin left.
+                hi -= 1
+                coin = ordered[hi]
+            else:
+                coin = ordered[lo]
+                lo += 1
+            chunk.append(coin)
+            funds += balance_of(coin)
+        chunks.append(chunk)
+    return chunks
+
+
+def add_arguments(parser):
+    parser.add_argument("--order", choices=["arrival", "balance"], help="Chunk coins in arrival order, or cheapest first with each chunk funding its own gas.", default="arrival")
@@ -0,0 +1,124 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Checked on every span; while False, spans are a shared no-op context manager.
+enabled = False
+
+_stages = {}
+_null_span = nullcontext()
+
+
+def push_stage(name):
+    _stages.setdefault(threading.get_ident(), []).append(name)
+
+
+def pop_stage():
+    stack = _stages.get(threading.get_ident())
+    if stack:
+        stack.pop()
+
+
+@contextmanager
+def _span(name):
+    push_stage(name)
+    try:
+        yield
+    finally:
+        pop_stage()
+
+
+def span(name):
+    """Tag samples taken inside this block with `name`. Free when profiling is off."""
+    if not enabled:
+        return _null_span
+    return _span(name)
+
+
+class Sampler:
+    """Samples the stack of every thread at a fixed interval.
+
+    Each sample is keyed by thread name, the active stage tags and the call stack, and written out
+    in the collapsed stack format read by flamegraph.pl, inferno and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        own_ident = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                tags = [f"[{stage}]" for stage in tuple(_stages.get(ident, ()))]
+                key = ";".join([names.get(ident, str(ident))] + tags + stack)
+                self.counts[key.replace("\n", " ")] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for key, count in self.counts.most_common():
+                f.write(f"{key} {count}\n")
+
+    def stage_summary(self):
+        totals = Counter()
+        for key, count in self.counts.items():
+            frames = key.split(";")
+            stage = next((frame for frame in frames[1:] if frame.startswith("[")), "[untagged]")
+            totals[f"{frames[0]} {stage}"] += count
+        return totals
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", help="Sample every thread's stack and write a flamegraph compatible profile.", action='store_true')
+    parser.add_argument("--profile-interval", type=float, help="Milliseconds between profile samples.", default=5.0)
+    parser.add_argument("--profile-dir", type=str, help="Directory to write profiles to.", default="profiles")
+
+
+def start(profile_dir="profiles", interval_ms=5.0):
+    """Enable stage tagging and start sampling. Returns a function that stops and writes the profile."""
+    global enabled
+    enabled = True
+    sampler = Sampler(interval_ms / 1000)
+    sampler.start()
+
+    def stop():
+        global enabled
+        sampler.stop()
+        enabled = False
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"profile-{time.strftime('%Y%m%d%H%M%S')}.folded")
+        sampler.write(path)
+        print(f"Wrote {sampler.samples} profile samples to {path}")
+        for key, count in sampler.stage_summary().most_common(20):
+            print(f"  {key}: {count * interval_ms / 1000:.1f}s")
+
+    return stop
+
+
+def start_from_args(args):
+    if not args.profile:
+        return lambda: None
+    return start(args.profile_dir, args.profile_interval)
@@ -0,0 +1,187 @@
+"""Coin state partitioned by object id prefix, one worker process per shard.
+
+`split_db` copies the coins table into one SQLite file per shard. `coordinate` starts a
+`merge_coins_v2_with_db.run` process per shard, each with its own gas objects, client and RPC
+connections, aggregates their progress and restarts failed shards with `--retry-failed`. Run a
+subset of shards per machine with `--only-shards` to spread a run across hosts.
+"""
+import copy
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import coin_db
+from metrics import format_seconds
+
+
+def shard_of(object_id, shard_count):
+    """Shard owning `object_id`, by contiguous ranges of its first four hex digits."""
+    return int(object_id[2:6], 16) * shard_count // 0x10000
+
+
+def shard_path(db_path, shard, shard_count):
+    base, ext = os.path.splitext(db_path)
+    return f"{base}.shard-{shard}-of-{shard_count}{ext}"
+
+
+def split_db(db_path, shard_count, purge=False, exclude_objects=()):
+    """Write one db per shard. `exclude_objects`, e.g. every host's gas objects, are left out of all of them."""
+    conn = coin_db.connect(db_path)
+    conn.create_function("shard_of", 1, lambda object_id: shard_of(object_id, shard_count), deterministic=True)
+    exclude_objects = list(exclude_objects)
+    placeholders = ', '.join('?' * len(exclude_objects))
+    paths = []
+    for shard in range(shard_count):
+        path = shard_path(db_path, shard, shard_count)
+        if os.path.exists(path):
+            if not purge:
+                raise ValueError(f"{path} already exists, pass --purge to replace it")
+            os.remove(path)
+        conn.execute("ATTACH DATABASE ? AS shard", (path,))
+        conn.execute(f"CREATE TABLE shard.coins AS SELECT * FROM coins WHERE shard_of(coin_object_id) = ? AND coin_object_id NOT IN ({placeholders}) ORDER BY idx", [shard] + exclude_objects)
+        conn.execute("CREATE INDEX shard.ix_coins_idx ON coins (idx)")
+        coin_db.create_balance_index(conn, "shard")
+        conn.commit()
+        conn.execute("DETACH DATABASE shard")
+        paths.append(path)
+    conn.close()
+    return paths
+
+
+def check_shard(path):
+    if not os.path.exists(path):
+        raise ValueError(f"{path} does not exist, run `split` with the same --db and --shards first")
+    conn = coin_db.connect(path)
+    try:
+        if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='coins'").fetchone() is None:
+            raise ValueError(f"{path} has no coins table, run `split` with --purge to rewrite it")
+    finally:
+        conn.close()
+
+
+def snapshot(shard):
+    from metrics import metrics
+
+    return (shard, metrics.coins_done, metrics.coins_total, metrics.rate(), dict(metrics.counters))
+
+
+def run_shard(args, shard, progress, interval):
+    from merge_coins_v2_with_db import run
+
+    # Shard dbs come from `split`, never load a csv into one.
+    conn = coin_db.connect(args.db)
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(interval):
+            progress.put(snapshot(shard))
+
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        run(args, conn)
+    finally:
+        stop.set()
+        progress.put(snapshot(shard))
+
+
+def shard_args(args, shard, gas_objects, retry_failed):
+    child = copy.copy(args)
+    vars(child).pop("handler", None)
+    child.db = shard_path(args.db, shard, args.shards)
+    child.gas_objects = gas_objects
+    # Other shards' gas objects can sit in this shard's db, they must never be merged here.
+    child.exclude_objects = list(args.gas_objects) + list(args.exclude_objects)
+    child.purge = False
+    child.retry_failed = retry_failed
+    # The coordinator prints the combined status line.
+    child.status_interval = 0
+    child.metrics_port = None
+    if args.metrics_file:
+        child.metrics_file = f"{args.metrics_file}.shard-{shard}"
+    child.profile_dir = os.path.join(args.profile_dir, f"shard-{shard}")
+    return child
+
+
+def coordinate(args):
+    shards = args.only_shards if args.only_shards else list(range(args.shards))
+    out_of_range = [shard for shard in shards if not 0 <= shard < args.shards]
+    if out_of_range:
+        raise ValueError(f"--only-shards {out_of_range} out of range for --shards {args.shards}")
+    for shard in shards:
+        check_shard(shard_path(args.db, shard, args.shards))
+    if len(args.gas_objects) < len(shards):
+        raise ValueError(f"Need at least one gas object per shard, got {len(args.gas_objects)} for {len(shards)} shards")
+    gas_for = {shard: args.gas_objects[i::len(shards)] for i, shard in enumerate(shards)}
+
+    ctx = multiprocessing.get_context("spawn")
+    progress = ctx.Queue()
+    interval = args.status_interval or 10.0
+
+    def start(shard, retry_failed):
+        child_args = shard_args(args, shard, gas_for[shard], retry_failed)
+        process = ctx.Process(target=run_shard, args=(child_args, shard, progress, interval), name=f"shard-{shard}")
+        process.start()
+        return process
+
+    started = time.time()
+    processes = {shard: start(shard, args.retry_failed) for shard in shards}
+    restarts = {shard: 0 for shard in shards}
+    latest = {}
+    done_before = {shard: 0 for shard in shards}
+    totals = {}
+    failed = []
+
+    def drain(until):
+        while True:
+            try:
+                shard, done, total, rate, counters = progress.get(timeout=max(until - time.time(), 0.01))
+            except queue.Empty:
+                if time.time() >= until:
+                    return
+                continue
+            latest[shard] = (done, rate, counters)
+            if total is not None:
+                totals.setdefault(shard, total)
+
+    def print_status():
+        done = sum(done_before.values()) + sum(d for d, _, _ in latest.values())
+        rate = sum(r for _, r, _ in latest.values())
+        total = sum(totals.values()) if len(totals) == len(shards) else None
+        eta = (total - done) / rate if total is not None and rate > 0 else None
+        tx_failed = sum(c.get("transactions_failed", 0) for _, _, c in latest.values())
+        print(" | ".join([
+            f"[{time.time() - started:.0f}s]",
+            f"shards {len(processes)}/{len(shards)} running",
+            f"coins {done}" + (f"/{total}" if total is not None else ""),
+            f"{rate:.1f}/s",
+            f"eta {format_seconds(eta)}",
+            f"failed txs {tx_failed}",
+        ]), flush=True)
+
+    while processes:
+        drain(time.time() + interval)
+        exited = [shard for shard, process in processes.items() if not process.is_alive()]
+        if exited:
+            # Pick up the final snapshot each exited shard sent before counting it.
+            drain(time.time() + 0.5)
+        for shard in exited:
+            process = processes.pop(shard)
+            process.join()
+            if process.exitcode == 0:
+                done, _, counters = latest.get(shard, (0, 0.0, {}))
+                latest[shard] = (done, 0.0, counters)
+                print(f"Shard {shard} complete")
+            elif restarts[shard] < args.max_restarts:
+                restarts[shard] += 1
+                done_before[shard] += latest.pop(shard, (0, 0.0, {}))[0]
+                print(f"Shard {shard} exited with {process.exitcode}, restarting with --retry-failed ({restarts[shard]}/{args.max_restarts})")
+                processes[shard] = start(shard, True)
+            else:
+                print(f"Shard {shard} exited with {process.exitcode}, giving up after {restarts[shard]} restarts")
+                failed.append(shard)
+        print_status()
+
+    if failed:
+        raise SystemExit(f"Shards {failed} failed")